@@ -1,4 +1,9 @@
 from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import mmap
+import os
+from typing import BinaryIO, Iterable
 
 DIGIT_STRS = {
     "one": 1,
@@ -14,46 +19,237 @@ DIGIT_STRS = {
 }
 
 
+class DigitAutomaton:
+    """
+    Aho-Corasick automaton over a set of patterns, compiled into a full transition table.
+    None of the digit words contain each other, so the first match to finish is also the first to start.
+    """
+
+    def __init__(self, patterns: dict[str, int]):
+        goto: list[dict[str, int]] = [{}]
+        fail = [0]
+        self.output: list[int | None] = [None]
+        for pattern, value in patterns.items():
+            state = 0
+            for char in pattern:
+                if char not in goto[state]:
+                    goto.append({})
+                    fail.append(0)
+                    self.output.append(None)
+                    goto[state][char] = len(goto) - 1
+                state = goto[state][char]
+            self.output[state] = value
+
+        # Breadth-first, so every state's fail link is complete before its children need it
+        self.transitions: list[dict[str, int]] = [{} for _ in goto]
+        self.transitions[0] = dict(goto[0])
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            if self.output[state] is None:
+                self.output[state] = self.output[fail[state]]
+            # Inherit everything the fail state can do, then override with our own edges
+            self.transitions[state] = dict(self.transitions[fail[state]])
+            for char, child in goto[state].items():
+                fail[child] = self.transitions[fail[state]].get(char, 0)
+                self.transitions[state][char] = child
+                queue.append(child)
+
+    def first_match(self, chars: Iterable[str]) -> int:
+        transitions = self.transitions
+        output = self.output
+        state = 0
+        for char in chars:
+            state = transitions[state].get(char, 0)
+            if output[state] is not None:
+                return output[state]
+        # No matches, return 0
+        return 0
+
+
+ASCII_DIGITS = {str(x): x for x in range(10)}
+
+# compile all automatons only once. The right-hand ones match reversed patterns so the line can be read backwards
+LEFT_AUTOMATON = DigitAutomaton(DIGIT_STRS | ASCII_DIGITS)
+RIGHT_AUTOMATON = DigitAutomaton(
+    {s[::-1]: num for s, num in (DIGIT_STRS | ASCII_DIGITS).items()}
+)
+DIGIT_ONLY_AUTOMATON = DigitAutomaton(ASCII_DIGITS)
+
+
+# Used by the bytes-level part-1 path, which deletes every byte that isn't an ASCII digit or newline
+ZERO_BYTE = ord("0")
+NON_DIGIT_BYTES = bytes(
+    x for x in range(256) if not (ZERO_BYTE <= x <= ord("9") or x == ord("\n"))
+)
+BLOCK_SIZE = 1 << 20
+
+
 def get_left_number(line: str, digit_only: bool):
-    length = len(line)
-    start_index = 0
-    while start_index < length:
-        if line[start_index].isdigit():
-            return int(line[start_index])
-        if not digit_only:
-            for s, num in DIGIT_STRS.items():
-                if line[start_index:].startswith(s):
-                    return num
-        start_index += 1
-    # No matches, return 0
-    return 0
+    automaton = DIGIT_ONLY_AUTOMATON if digit_only else LEFT_AUTOMATON
+    return automaton.first_match(line)
+
+
+def test_get_left_number():
+    assert get_left_number("two1nine", False) == 2
+    assert get_left_number("two1nine", True) == 1
+    assert get_left_number("eightwothree", False) == 8
+    assert get_left_number("zoneight234", False) == 1
+    assert get_left_number("ninine", False) == 9
+    assert get_left_number("abc", False) == 0
+    assert get_left_number("", True) == 0
 
 
 def get_right_number(line: str, digit_only: bool):
-    end_index = len(line) - 1
-    while end_index >= 0:
-        if line[end_index].isdigit():
-            return int(line[end_index])
-        if not digit_only:
-            for s, num in DIGIT_STRS.items():
-                if line[: end_index + 1].endswith(s):
-                    return num
-        end_index -= 1
-    # No matches, return 0
-    return 0
+    automaton = DIGIT_ONLY_AUTOMATON if digit_only else RIGHT_AUTOMATON
+    return automaton.first_match(reversed(line))
+
+
+def test_get_right_number():
+    assert get_right_number("two1nine", False) == 9
+    assert get_right_number("two1nine", True) == 1
+    assert get_right_number("xtwone3four", False) == 4
+    assert get_right_number("zoneight", False) == 8
+    assert get_right_number("sevenine", False) == 9
+    assert get_right_number("7pqrstsixteen", True) == 7
+    assert get_right_number("abc", False) == 0
 
 
 def number_from_line(line: str, digit_only: bool) -> int:
     return get_left_number(line, digit_only) * 10 + get_right_number(line, digit_only)
 
 
-def solution(data: str, digit_only: bool) -> int:
+def stream_solution(lines: Iterable[str], digit_only: bool) -> int:
+    """
+    Totals the lines as they are read, so an open file never has to be held in memory all at once.
+    Trailing newlines are fine to leave on, as they never match anything.
+    """
     total = 0
-    for line in data.split("\n"):
+    for line in lines:
         total += number_from_line(line, digit_only)
     return total
 
 
+def test_stream_solution():
+    lines = ["two1nine\n", "eightwothree\n", "abcone2threexyz\n", "\n"]
+    assert stream_solution(lines, False) == 29 + 83 + 13
+    assert stream_solution(iter(lines), True) == 11 + 22
+    assert stream_solution([], False) == 0
+
+
+def digit_only_bytes_solution(data: bytes) -> int:
+    """
+    Part-1 total straight from the raw bytes. Once everything but digits and newlines is deleted,
+    each line is only its digits, so just its first and last byte need to be looked at
+    """
+    total = 0
+    for digits in data.translate(None, NON_DIGIT_BYTES).split(b"\n"):
+        if digits:
+            total += (digits[0] - ZERO_BYTE) * 10 + digits[-1] - ZERO_BYTE
+    return total
+
+
+def test_digit_only_bytes_solution():
+    lines = ["1abc2", "pqr3stu8vwx", "a1b2c3d4e5f", "treb7uchet", "", "abc", "x9"]
+    assert (
+        digit_only_bytes_solution("\n".join(lines).encode()) == 12 + 38 + 15 + 77 + 99
+    )
+    for line in lines + ["two1nine", "4nineeightseven2", "\u00e9t\u00e95\u00e9"]:
+        assert digit_only_bytes_solution(line.encode()) == number_from_line(line, True)
+    assert digit_only_bytes_solution(b"") == 0
+
+
+def stream_digit_only_solution(f: BinaryIO) -> int:
+    """
+    Runs `digit_only_bytes_solution` over a binary file in blocks, each extended to the end of its last line
+    """
+    total = 0
+    while block := f.read(BLOCK_SIZE):
+        total += digit_only_bytes_solution(block + f.readline())
+    return total
+
+
+def chunk_boundaries(buffer: mmap.mmap, chunks: int) -> list[tuple[int, int]]:
+    """
+    Splits the buffer into roughly `chunks` byte ranges of [start, end), each ending just after a newline
+    so no line is ever split between two ranges
+    """
+    size = len(buffer)
+    boundaries = [0]
+    for i in range(1, chunks):
+        newline = buffer.find(b"\n", max(boundaries[-1], size * i // chunks))
+        if newline == -1:
+            break
+        boundaries.append(newline + 1)
+    boundaries.append(size)
+    return [
+        (start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end
+    ]
+
+
+def solve_chunk(filename: str, start: int, end: int, digit_only: bool) -> int:
+    total = 0
+    with open(filename, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as buffer:
+        if digit_only:
+            while start < end:
+                block_end = buffer.find(b"\n", min(start + BLOCK_SIZE, end), end)
+                block_end = end if block_end == -1 else block_end + 1
+                total += digit_only_bytes_solution(buffer[start:block_end])
+                start = block_end
+            return total
+        while start < end:
+            newline = buffer.find(b"\n", start, end)
+            if newline == -1:
+                newline = end
+            line = buffer[start:newline].decode()
+            total += number_from_line(line, digit_only)
+            start = newline + 1
+    return total
+
+
+def parallel_solution(filename: str, digit_only: bool, workers: int) -> int:
+    """
+    Memory-maps the file and sums newline-aligned chunks of it across a pool of `workers` processes
+    """
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # mmap refuses empty files, and there is nothing to add up anyway
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            ranges = chunk_boundaries(buffer, workers)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(solve_chunk, filename, start, end, digit_only)
+            for start, end in ranges
+        ]
+        return sum(future.result() for future in futures)
+
+
+def test_parallel_solution(tmp_path):
+    data = """two1nine
+eightwothree
+abcone2threexyz
+xtwone3four
+4nineeightseven2
+zoneight234
+7pqrstsixteen"""
+    filename = tmp_path / "input.txt"
+    filename.write_text(data)
+    for workers in [1, 2, 3, 16]:
+        assert parallel_solution(str(filename), False, workers) == 281
+        assert parallel_solution(str(filename), True, workers) == 209
+
+    filename.write_text("")
+    assert parallel_solution(str(filename), False, 4) == 0
+
+
+def solution(data: str, digit_only: bool) -> int:
+    return stream_solution(data.split("\n"), digit_only)
+
+
 def main():
     parser = ArgumentParser()
     parser.add_argument(
@@ -70,6 +266,13 @@ def main():
         help="Use the part-1 line parsing on the input",
     )
 
+    parser.add_argument(
+        "--workers",
+        default=None,
+        type=int,
+        help="Split the input file across this many processes. Only used along with `--filename`",
+    )
+
     args = parser.parse_args()
 
     # Part 1 example data, can use instead if running part 1
@@ -86,11 +289,16 @@ xtwone3four
 zoneight234
 7pqrstsixteen"""
 
-    if args.filename:
+    if args.filename and args.workers:
+        output = parallel_solution(args.filename, args.digit_only, args.workers)
+    elif args.filename and args.digit_only:
+        with open(args.filename, "rb") as f:
+            output = stream_digit_only_solution(f)
+    elif args.filename:
         with open(args.filename) as f:
-            data = f.read()
-
-    output = solution(data, args.digit_only)
+            output = stream_solution(f, args.digit_only)
+    else:
+        output = solution(data, args.digit_only)
 
     print(f"Solution: {output}")
 
@@ -3,6 +3,8 @@ from collections import defaultdict
 import math
 import re
 
+import numpy as np
+
 LIMITS = defaultdict(
     int,
     {
@@ -12,49 +14,230 @@ LIMITS = defaultdict(
     },
 )
 
+# Fixed slot order for the per-game max vectors
+COLORS = ("red", "green", "blue")
+COLOR_SLOTS = {color: i for i, color in enumerate(COLORS)}
+LIMITS_VECTOR = [LIMITS[color] for color in COLORS]
+
 # compile all patterns only once
 LINE_PATTERN = re.compile(r"^Game (\d+):(.*)$")
+COUNT_COLOR_PATTERN = re.compile(r"(\d+) (red|green|blue)")
+
 
+def max_counts(remainder: str) -> list[int]:
+    """
+    Folds every `(count, color)` pair of a game into the max seen for each color, ignoring how they were
+    grouped into grabs. A game is possible if every max is within the limits, and the maxes are also the
+    minimum number of each block needed
+    """
+    maxes = [0, 0, 0]
+    for count, color in COUNT_COLOR_PATTERN.findall(remainder):
+        slot = COLOR_SLOTS[color]
+        count = int(count)
+        if count > maxes[slot]:
+            maxes[slot] = count
+    return maxes
 
-def create_block_dict(grab: str) -> dict[str, int]:
-    # First, pull out the count and color
-    count_colors = [x.strip().split(" ") for x in grab.split(",")]
-    # Then make it in a dictionary, so we can handle this easier
-    return {color: int(count) for count, color in count_colors}
+
+def test_max_counts():
+    assert max_counts(" 3 blue, 4 red; 1 red, 2 green, 6 blue; 2 green") == [4, 2, 6]
+    assert max_counts(" 8 green, 6 blue, 20 red; 5 blue, 4 red, 13 green") == [
+        20,
+        13,
+        6,
+    ]
+    assert max_counts(" 1 blue") == [0, 0, 1]
+    assert max_counts("") == [0, 0, 0]
 
 
 # Used for part 1, along with the static `LIMITS`
-def valid_input(color_counts: dict[str, int]) -> bool:
-    for color, count in color_counts.items():
-        if count > LIMITS[color]:
+def valid_input(maxes: list[int]) -> bool:
+    for count, limit in zip(maxes, LIMITS_VECTOR):
+        if count > limit:
             return False
     return True
 
 
+def game_power(maxes: list[int]) -> int:
+    # Colors that never showed up aren't counted, rather than zeroing out the game
+    return math.prod(count for count in maxes if count != 0)
+
+
 def parse_line(line: str, part_two: bool) -> int:
     match = LINE_PATTERN.match(line)
     if match is None:
         print("Error, shouldn't happen")
         return 0
     num, remainder = match.group(1, 2)
-    num = int(num)
-    # Split into each observation of bag contents
-    individual_grabs = remainder.split(";")
-
-    # Going to keep logic running to calculate both ways, then just return the result based on `part_two`
-    min_counts = defaultdict(int)
-    valid = True
-    for grab in individual_grabs:
-        blocks = create_block_dict(grab)
-        valid &= valid_input(blocks)
-        # Update the minimum count of each block needed.
-        for color, count in blocks.items():
-            min_counts[color] = max(min_counts[color], count)
+    maxes = max_counts(remainder)
 
     if part_two:
-        return math.prod(min_counts.values())
+        return game_power(maxes)
     else:
-        return num if valid else 0
+        return int(num) if valid_input(maxes) else 0
+
+
+def test_parse_line():
+    line = "Game 3: 8 green, 6 blue, 20 red; 5 blue, 4 red, 13 green; 5 green, 1 red"
+    assert parse_line(line, False) == 0
+    assert parse_line(line, True) == 1560
+    line = "Game 5: 6 red, 1 blue, 3 green; 2 blue, 1 red, 2 green"
+    assert parse_line(line, False) == 5
+    assert parse_line(line, True) == 36
+    assert parse_line("Game 7: 2 red", True) == 2
+
+
+class GameTable:
+    """
+    Every game parsed once into columns: `ids` of shape (games,) and `maxes` of shape (games, 3),
+    with the colors in `COLORS` order. Both parts are then whole-column operations
+    """
+
+    def __init__(self, ids: np.ndarray, maxes: np.ndarray):
+        self.ids = ids
+        self.maxes = maxes
+
+    @classmethod
+    def from_data(cls, data: str) -> "GameTable":
+        ids = []
+        maxes = []
+        for line in data.split("\n"):
+            match = LINE_PATTERN.match(line)
+            if match is None:
+                print("Error, shouldn't happen")
+                continue
+            num, remainder = match.group(1, 2)
+            ids.append(int(num))
+            maxes.append(max_counts(remainder))
+        return cls(
+            np.array(ids, dtype=np.int64),
+            np.array(maxes, dtype=np.int64).reshape(-1, len(COLORS)),
+        )
+
+    def possible(self, limits: list[int] = LIMITS_VECTOR) -> np.ndarray:
+        return (self.maxes <= np.asarray(limits)).all(axis=1)
+
+    def part_one(self, limits: list[int] = LIMITS_VECTOR) -> int:
+        return int(self.ids[self.possible(limits)].sum())
+
+    def part_two(self) -> int:
+        # Same as `game_power`, colors that never showed up count as 1 in the product
+        return int(np.where(self.maxes == 0, 1, self.maxes).prod(axis=1).sum())
+
+
+def test_game_table():
+    data = """Game 1: 3 blue, 4 red; 1 red, 2 green, 6 blue; 2 green
+Game 2: 1 blue, 2 green; 3 green, 4 blue, 1 red; 1 green, 1 blue
+Game 3: 8 green, 6 blue, 20 red; 5 blue, 4 red, 13 green; 5 green, 1 red
+Game 4: 1 green, 3 red, 6 blue; 3 green, 6 red; 3 green, 15 blue, 14 red
+Game 5: 6 red, 1 blue, 3 green; 2 blue, 1 red, 2 green
+Game 6: 2 red"""
+    table = GameTable.from_data(data)
+    assert table.ids.tolist() == [1, 2, 3, 4, 5, 6]
+    assert table.maxes[0].tolist() == [4, 2, 6]
+    assert table.possible().tolist() == [True, True, False, False, True, True]
+    assert table.part_one() == solution(data, False) == 14
+    assert table.part_one([20, 13, 15]) == 21
+    assert table.part_two() == solution(data, True) == 2288
+    assert GameTable.from_data("").part_two() == 0
+
+
+class LimitIndex:
+    """
+    Answers part one for many bag configurations against the same `GameTable`.
+    Games are kept sorted by red, with green and blue compressed down to their ranks among the distinct
+    values seen. A batch of queries is answered in order of red limit: every game whose red fits is added to
+    a 2-d Fenwick tree over (green, blue) as the sweep passes it, and a query is then one prefix sum.
+    Memory is (distinct green) x (distinct blue) for the tree, rather than a grid over all three colors
+    """
+
+    def __init__(self, table: GameTable):
+        order = np.argsort(table.maxes[:, 0], kind="stable")
+        self.green_axis = np.unique(table.maxes[:, 1])
+        self.blue_axis = np.unique(table.maxes[:, 2])
+        self.reds = table.maxes[order, 0].tolist()
+        # Fenwick trees count from 1
+        self.greens = (
+            np.searchsorted(self.green_axis, table.maxes[order, 1]) + 1
+        ).tolist()
+        self.blues = (
+            np.searchsorted(self.blue_axis, table.maxes[order, 2]) + 1
+        ).tolist()
+        self.ids = table.ids[order].tolist()
+
+    def part_one(self, limits: np.ndarray) -> np.ndarray:
+        """
+        `limits` is shaped (queries, 3) in `COLORS` order, and the id total for each query is returned
+        """
+        limits = np.asarray(limits).reshape(-1, len(COLORS))
+        # How many distinct greens and blues fit under each limit, which is also its prefix in the tree
+        green_cells = np.searchsorted(
+            self.green_axis, limits[:, 1], side="right"
+        ).tolist()
+        blue_cells = np.searchsorted(
+            self.blue_axis, limits[:, 2], side="right"
+        ).tolist()
+        red_limits = limits[:, 0].tolist()
+
+        green_size = len(self.green_axis)
+        blue_size = len(self.blue_axis)
+        tree = [[0] * (blue_size + 1) for _ in range(green_size + 1)]
+        totals = np.zeros(len(limits), dtype=np.int64)
+        game = 0
+        for query in sorted(range(len(limits)), key=red_limits.__getitem__):
+            while game < len(self.reds) and self.reds[game] <= red_limits[query]:
+                green = self.greens[game]
+                while green <= green_size:
+                    row = tree[green]
+                    blue = self.blues[game]
+                    while blue <= blue_size:
+                        row[blue] += self.ids[game]
+                        blue += blue & -blue
+                    green += green & -green
+                game += 1
+
+            total = 0
+            green = green_cells[query]
+            while green > 0:
+                row = tree[green]
+                blue = blue_cells[query]
+                while blue > 0:
+                    total += row[blue]
+                    blue -= blue & -blue
+                green -= green & -green
+            totals[query] = total
+        return totals
+
+
+def test_limit_index():
+    data = """Game 1: 3 blue, 4 red; 1 red, 2 green, 6 blue; 2 green
+Game 2: 1 blue, 2 green; 3 green, 4 blue, 1 red; 1 green, 1 blue
+Game 3: 8 green, 6 blue, 20 red; 5 blue, 4 red, 13 green; 5 green, 1 red
+Game 4: 1 green, 3 red, 6 blue; 3 green, 6 red; 3 green, 15 blue, 14 red
+Game 5: 6 red, 1 blue, 3 green; 2 blue, 1 red, 2 green"""
+    table = GameTable.from_data(data)
+    index = LimitIndex(table)
+    queries = [
+        LIMITS_VECTOR,
+        [0, 0, 0],
+        [100, 100, 100],
+        [4, 3, 6],
+        [6, 3, 4],
+        [20, 13, 15],
+        [14, 13, 14],
+    ]
+    assert index.part_one(queries).tolist() == [
+        table.part_one(query) for query in queries
+    ]
+    assert LimitIndex(GameTable.from_data("")).part_one(queries).tolist() == [0] * 7
+
+    # Wide count ranges only cost memory in green and blue
+    rng = np.random.default_rng(0)
+    table = GameTable(np.arange(1, 501), rng.integers(0, 1000, (500, 3)))
+    queries = rng.integers(0, 1000, (200, 3))
+    assert LimitIndex(table).part_one(queries).tolist() == [
+        table.part_one(query) for query in queries
+    ]
 
 
 def solution(data: str, part_two: bool) -> int:
@@ -80,6 +263,13 @@ def main():
         help="To produce output for the part2 version of this problem",
     )
 
+    parser.add_argument(
+        "--engine",
+        default="python",
+        choices=["python", "numpy"],
+        help="Solve line by line in python, or parse once into a numpy `GameTable`",
+    )
+
     args = parser.parse_args()
 
     data = """Game 1: 3 blue, 4 red; 1 red, 2 green, 6 blue; 2 green
@@ -92,7 +282,11 @@ Game 5: 6 red, 1 blue, 3 green; 2 blue, 1 red, 2 green"""
         with open(args.filename) as f:
             data = f.read()
 
-    output = solution(data, args.part_two)
+    if args.engine == "numpy":
+        table = GameTable.from_data(data)
+        output = table.part_two() if args.part_two else table.part_one()
+    else:
+        output = solution(data, args.part_two)
 
     print(f"Solution: {output}")
 
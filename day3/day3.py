@@ -1,8 +1,31 @@
 from argparse import ArgumentParser
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+from pathlib import Path
+import re
+from typing import Iterable, Iterator, Sequence
+
+import numpy as np
+
+# compile all patterns only once
+NUMBER_PATTERN = re.compile(r"[0-9]+")
+
+EXAMPLE_DATA = """467..114..
+...*......
+..35..633.
+......#...
+617*......
+.....+.58.
+..592.....
+......755.
+...$.*....
+.664.598.."""
 
 
 class PartNumber:
+    __slots__ = ("row", "start_col", "end_col", "value")
+
     def __init__(self, row, start_col, end_col, value):
         self.row: int = row
         self.start_col: int = start_col
@@ -31,19 +54,62 @@ class PartNumber:
         return not self.__eq__(other)
 
     def __hash__(self):
-        return (
-            hash(self.row)
-            + hash(self.start_col)
-            + hash(self.end_col)
-            + hash(self.value)
+        return hash((self.row, self.start_col, self.end_col, self.value))
+
+
+class PartTable:
+    """
+    Part numbers stored column-wise, one flat array per field, and addressed by integer id.
+    `PartNumber`s are only built on request by `part`
+    """
+
+    def __init__(self):
+        self.rows = array("i")
+        self.start_cols = array("i")
+        self.end_cols = array("i")
+        # A plain list, since numbers on wide grids can outgrow any fixed-size integer
+        self.values: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def add(self, row: int, start_col: int, end_col: int, value: int) -> int:
+        self.rows.append(row)
+        self.start_cols.append(start_col)
+        self.end_cols.append(end_col)
+        self.values.append(value)
+        return len(self.values) - 1
+
+    def part(self, part_id: int) -> PartNumber:
+        return PartNumber(
+            self.rows[part_id],
+            self.start_cols[part_id],
+            self.end_cols[part_id],
+            self.values[part_id],
         )
 
 
+def test_part_table():
+    table = PartTable()
+    assert table.add(1, 2, 4, 123) == 0
+    assert table.add(2, 1, 1, 7) == 1
+    assert len(table) == 2
+    assert table.part(0) == PartNumber(1, 2, 4, 123)
+    assert table.part(1) == PartNumber(2, 1, 1, 7)
+    assert table.values == [123, 7]
+    assert table.part(table.add(0, 0, 19, 2**64)).value == 2**64
+    # Mirrored positions used to collide, now they only match if every field does
+    assert hash(PartNumber(1, 2, 2, 5)) != hash(PartNumber(2, 1, 2, 5))
+    assert len({PartNumber(1, 2, 2, 5), PartNumber(2, 1, 2, 5)}) == 2
+
+
 @dataclass
 class Grid:
     rows: list[str]
     height: int
     width: int
+    # Built on first use by `get_symbol_mask`
+    symbol_mask: bytearray | None = None
 
 
 @dataclass
@@ -87,40 +153,46 @@ def test_within_grid():
     assert within_grid(grid, 10, 10) is False, "Failed within_grid check"
 
 
+def get_symbol_mask(grid: Grid) -> bytearray:
+    """
+    Flat `height * width` mask, set for every cell that is a symbol or touches one (diagonals included).
+    A number is then a valid part if any one of its own digits is set in the mask
+    """
+    if grid.symbol_mask is not None:
+        return grid.symbol_mask
+    mask = bytearray(grid.height * grid.width)
+    for row in range(grid.height):
+        for col, char in enumerate(grid.rows[row][: grid.width]):
+            if not is_symbol(char):
+                continue
+            for check_row in range(max(row - 1, 0), min(row + 2, grid.height)):
+                start = check_row * grid.width + max(col - 1, 0)
+                end = check_row * grid.width + min(col + 2, grid.width)
+                mask[start:end] = b"\x01" * (end - start)
+    grid.symbol_mask = mask
+    return mask
+
+
+def test_get_symbol_mask():
+    grid = Grid(["#...", "....", "..*."], height=3, width=4)
+    assert list(get_symbol_mask(grid)) == [
+        1, 1, 0, 0,
+        1, 1, 1, 1,
+        0, 1, 1, 1,
+    ]  # fmt: skip
+    grid = Grid(["1.2", "...", "3.4"], height=3, width=3)
+    assert not any(get_symbol_mask(grid))
+
+
+def scan_part_numbers(line: str, row_num: int, table: PartTable):
+    for match in NUMBER_PATTERN.finditer(line):
+        table.add(row_num, match.start(), match.end() - 1, int(match.group()))
+
+
 def get_part_numbers(line: str, row_num: int) -> list[PartNumber]:
-    part_nums = []
-    index = 0
-    num_start = None
-    length = len(line)
-    while index < length:
-        char = line[index]
-        if char.isdigit():
-            if num_start is None:
-                num_start = index
-        else:
-            if num_start is not None:
-                part_nums.append(
-                    PartNumber(
-                        row_num,
-                        num_start,
-                        index - 1,
-                        int(line[num_start:index]),
-                    )
-                )
-                num_start = None
-        index += 1
-
-    if num_start is not None:
-        # At the end of the string, and therefore this part number that was in-progress
-        part_nums.append(
-            PartNumber(
-                row_num,
-                num_start,
-                index - 1,
-                int(line[num_start:index]),
-            )
-        )
-    return part_nums
+    table = PartTable()
+    scan_part_numbers(line, row_num, table)
+    return [table.part(part_id) for part_id in range(len(table))]
 
 
 def test_get_part_numbers():
@@ -192,19 +264,14 @@ def valid_part_number(grid: Grid, part_number: PartNumber):
     X12X.
     XXXX.
     ```
+    Rather than checking those each time, any digit of the number being set in the grid's symbol mask
+    means the same thing
     """
-
-    locations = get_check_locations(part_number)
-
-    # Once we have the list, iterate through it until we find a symbol
-    for row, col in locations:
-        if not within_grid(grid, row, col):
-            continue
-        if is_symbol(grid.rows[row][col]):
-            # Can exit early here as we found an adjacent symbol
-            return True
-    # No symbol found
-    return False
+    mask = get_symbol_mask(grid)
+    row_start = part_number.row * grid.width
+    return any(
+        mask[row_start + part_number.start_col : row_start + part_number.end_col + 1]
+    )
 
 
 def test_valid_part_number():
@@ -236,6 +303,15 @@ def test_valid_part_number():
     assert valid_part_number(grid, part1) is False
 
 
+def valid_part_id(grid: Grid, table: PartTable, part_id: int) -> bool:
+    # Same check as `valid_part_number`, straight from the table's columns
+    mask = get_symbol_mask(grid)
+    row_start = table.rows[part_id] * grid.width
+    start = row_start + table.start_cols[part_id]
+    end = row_start + table.end_cols[part_id] + 1
+    return any(mask[start:end])
+
+
 def only_valid_part_numbers(
     grid: Grid, part_numbers: list[PartNumber]
 ) -> list[PartNumber]:
@@ -279,34 +355,329 @@ def test_possible_gears():
     assert (0, 2) in gears
 
 
+def add_to_part_index(grid: Grid, part_index: array, table: PartTable, part_id: int):
+    start = table.rows[part_id] * grid.width + table.start_cols[part_id]
+    end = table.rows[part_id] * grid.width + table.end_cols[part_id] + 1
+    part_index[start:end] = array("i", [part_id]) * (end - start)
+
+
+def gear_ratio_total(grid: Grid, part_index: array, values: Sequence[int]) -> int:
+    """
+    `part_index` is a flat `height * width` array holding the id in `values` of the number
+    covering each cell, or -1. Each `*` only has to look at its 8 neighbors to find which parts touch it
+    """
+    total = 0
+    for row in range(grid.height):
+        col = grid.rows[row].find("*")
+        while col != -1:
+            touching = set()
+            for check_row in range(max(row - 1, 0), min(row + 2, grid.height)):
+                row_start = check_row * grid.width
+                for check_col in range(max(col - 1, 0), min(col + 2, grid.width)):
+                    touching.add(part_index[row_start + check_col])
+            touching.discard(-1)
+            if len(touching) == 2:
+                first, second = touching
+                total += values[first] * values[second]
+            col = grid.rows[row].find("*", col + 1)
+    return total
+
+
+def test_gear_ratio_total():
+    grid = Grid(["12.", ".*3", "..."], 3, 3)
+    table = PartTable()
+    table.add(0, 0, 1, 12)
+    table.add(1, 2, 2, 3)
+    part_index = array("i", [-1]) * 9
+    for part_id in range(len(table)):
+        add_to_part_index(grid, part_index, table, part_id)
+    assert list(part_index) == [0, 0, -1, -1, -1, 1, -1, -1, -1]
+    assert gear_ratio_total(grid, part_index, table.values) == 36
+
+    # A third part touching the gear means it isn't one
+    grid = Grid(["12.", ".*3", "4.."], 3, 3)
+    add_to_part_index(grid, part_index, table, table.add(2, 0, 0, 4))
+    assert gear_ratio_total(grid, part_index, table.values) == 0
+
+
 def solution(data: str, part_two: bool) -> int:
-    possible_part_nums = []
+    table = PartTable()
     grid = Grid(data.split("\n"), 0, 0)
     grid.height = len(grid.rows)
     grid.width = len(grid.rows[0])
 
     for i in range(grid.height):
-        possible_part_nums.extend(get_part_numbers(grid.rows[i], i))
-    valid_part_nums = only_valid_part_numbers(grid, possible_part_nums)
+        scan_part_numbers(grid.rows[i], i, table)
 
     total = 0
     if part_two:
-        # todo: probably should move to its own function so it could be tested
-        part_nums_set = set(valid_part_nums)
-        gears = possible_gears(grid, valid_part_nums)
-        for gear_row, gear_col in gears:
-            matching_parts: list[PartNumber] = []
-            for part in part_nums_set:
-                if part.is_gear_connected(gear_row, gear_col):
-                    matching_parts.append(part)
-            if len(matching_parts) == 2:
-                total += matching_parts[0].value * matching_parts[1].value
+        # Only gears need to know which part covers each cell
+        part_index = array("i", [-1]) * (grid.height * grid.width)
+        for part_id in range(len(table)):
+            add_to_part_index(grid, part_index, table, part_id)
+        # Anything touching a `*` is a valid part already, so no need to filter first
+        total = gear_ratio_total(grid, part_index, table.values)
     else:
-        for part in valid_part_nums:
-            total += part.value
+        for part_id in range(len(table)):
+            if valid_part_id(grid, table, part_id):
+                total += table.values[part_id]
     return total
 
 
+# int64 holds every number of up to this many digits
+MAX_INT64_DIGITS = 18
+
+
+def exact_sum(values: np.ndarray) -> int:
+    """
+    Sum of non-negative `values`, in int64 when the total can't overflow and as Python ints otherwise
+    """
+    if len(values) == 0:
+        return 0
+    if values.dtype != object and int(values.max()) * len(values) < 2**63:
+        return int(values.sum())
+    return int(values.sum(dtype=object))
+
+
+def test_exact_sum():
+    assert exact_sum(np.array([], dtype=np.int64)) == 0
+    assert exact_sum(np.array([1, 2, 3], dtype=np.int64)) == 6
+    assert exact_sum(np.full(10, 10**18, dtype=np.int64)) == 10**19
+
+
+def numpy_solution(data: str, part_two: bool) -> int:
+    """
+    Same answers as `solution`, but over the whole grid at once as a 2-d `uint8` array.
+    Each row gets a '.' column on the end before flattening, so digit runs can't wrap onto the next row
+    """
+    rows = data.split("\n")
+    height = len(rows)
+    width = len(rows[0])
+    padded_width = width + 1
+    grid = np.frombuffer(
+        "".join(row[:width].ljust(padded_width, ".") for row in rows).encode(),
+        dtype=np.uint8,
+    ).reshape(height, padded_width)
+
+    digits = (grid >= ord("0")) & (grid <= ord("9"))
+    symbols = ~digits & (grid != ord("."))
+
+    # Dilate the symbols by OR-ing together the grid shifted each way, so every digit touching one is set
+    padded_symbols = np.pad(symbols, 1)
+    near_symbol = np.zeros_like(symbols)
+    for row_shift in range(3):
+        for col_shift in range(3):
+            near_symbol |= padded_symbols[
+                row_shift : row_shift + height, col_shift : col_shift + padded_width
+            ]
+
+    # Runs of digits start where the flattened digit mask steps up from 0 to 1, and end where it steps down
+    flat_digits = digits.ravel()
+    digit_steps = flat_digits.astype(np.int8)
+    run_starts = np.flatnonzero(np.diff(digit_steps, prepend=0) == 1)
+    run_ends = np.flatnonzero(np.diff(digit_steps, append=0) == -1)
+    if len(run_starts) == 0:
+        return 0
+    digit_cells = np.flatnonzero(flat_digits)
+    run_lengths = run_ends - run_starts + 1
+    # Where each run starts within `digit_cells`, and which run every digit belongs to
+    run_offsets = np.concatenate(([0], np.cumsum(run_lengths)[:-1]))
+    run_ids = np.repeat(np.arange(len(run_starts)), run_lengths)
+
+    # Rebuild each number from its digits, weighting each by its distance from the end of the run
+    place = np.power(10, run_ends[run_ids] - digit_cells, dtype=np.int64)
+    digit_values = grid.ravel()[digit_cells].astype(np.int64) - ord("0")
+    values = np.add.reduceat(digit_values * place, run_offsets)
+    if run_lengths.max() > MAX_INT64_DIGITS:
+        # Those wrapped around in int64, so rebuild them from their digits as Python ints
+        values = values.astype(object)
+        flat_grid = grid.ravel()
+        for run in np.flatnonzero(run_lengths > MAX_INT64_DIGITS):
+            values[run] = int(flat_grid[run_starts[run] : run_ends[run] + 1].tobytes())
+
+    if not part_two:
+        valid = np.logical_or.reduceat(near_symbol.ravel()[digit_cells], run_offsets)
+        return exact_sum(values[valid])
+
+    # Cell -> run id, with -1 for anything that isn't a digit, then bordered so every gear has 8 neighbors
+    part_index = np.full(height * padded_width, -1, dtype=np.int64)
+    part_index[digit_cells] = run_ids
+    part_index = np.pad(part_index.reshape(height, padded_width), 1, constant_values=-1)
+    gear_rows, gear_cols = np.nonzero(grid == ord("*"))
+    neighbors = np.stack(
+        [
+            part_index[gear_rows + row_shift, gear_cols + col_shift]
+            for row_shift in range(3)
+            for col_shift in range(3)
+        ],
+        axis=1,
+    )
+    neighbors.sort(axis=1)
+    # Count the distinct part ids around each gear, ignoring the -1s
+    distinct = (neighbors[:, 0] >= 0).astype(np.int64) + (
+        (neighbors[:, 1:] != neighbors[:, :-1]) & (neighbors[:, 1:] >= 0)
+    ).sum(axis=1)
+    gears = distinct == 2
+    first = np.where(neighbors[gears] < 0, len(values), neighbors[gears]).min(axis=1)
+    second = neighbors[gears].max(axis=1)
+    if values.dtype != object and int(values.max()) ** 2 >= 2**63:
+        values = values.astype(object)
+    return exact_sum(values[first] * values[second])
+
+
+def test_numpy_solution():
+    bundled = (Path(__file__).parent / "day3_input.txt").read_text()
+    long_numbers = "11111111111111111111*\n....................3"
+    for data in [EXAMPLE_DATA, bundled, "1*1", "..\n..", "12\n*.\n3.", long_numbers]:
+        for part_two in [False, True]:
+            assert numpy_solution(data, part_two) == solution(data, part_two)
+    assert numpy_solution(long_numbers, False) == 11111111111111111114
+    assert numpy_solution(long_numbers, True) == 33333333333333333333
+
+
+@dataclass
+class WindowRow:
+    line: str
+    parts: PartTable
+    # Id in `parts` of the number covering each column, or -1
+    part_index: array
+    # Set for every column with a symbol in it or right beside it
+    near_symbol: bytearray
+
+
+EMPTY_ROW = WindowRow("", PartTable(), array("i"), bytearray())
+
+
+def make_window_row(line: str, row_num: int) -> WindowRow:
+    parts = PartTable()
+    scan_part_numbers(line, row_num, parts)
+    part_index = array("i", [-1]) * len(line)
+    for part_id in range(len(parts)):
+        start = parts.start_cols[part_id]
+        end = parts.end_cols[part_id] + 1
+        part_index[start:end] = array("i", [part_id]) * (end - start)
+    near_symbol = bytearray(len(line))
+    for col, char in enumerate(line):
+        if is_symbol(char):
+            start = max(col - 1, 0)
+            end = min(col + 2, len(line))
+            near_symbol[start:end] = b"\x01" * (end - start)
+    return WindowRow(line, parts, part_index, near_symbol)
+
+
+def window_row_total(
+    above: WindowRow, current: WindowRow, below: WindowRow, part_two: bool
+) -> int:
+    """
+    Everything about the middle row's numbers and gears can be worked out from the rows either side of it
+    """
+    window = (above, current, below)
+    total = 0
+    if not part_two:
+        parts = current.parts
+        for part_id in range(len(parts)):
+            start = parts.start_cols[part_id]
+            end = parts.end_cols[part_id] + 1
+            if any(any(row.near_symbol[start:end]) for row in window):
+                total += parts.values[part_id]
+        return total
+
+    col = current.line.find("*")
+    while col != -1:
+        # Keyed by which row of the window the part is in, as part ids are only unique within a row
+        touching = set()
+        for offset, row in enumerate(window):
+            for check_col in range(max(col - 1, 0), min(col + 2, len(row.part_index))):
+                if row.part_index[check_col] != -1:
+                    touching.add((offset, row.part_index[check_col]))
+        if len(touching) == 2:
+            (first_row, first), (second_row, second) = touching
+            total += (
+                window[first_row].parts.values[first]
+                * window[second_row].parts.values[second]
+            )
+        col = current.line.find("*", col + 1)
+    return total
+
+
+def stream_row_totals(lines: Iterable[str], part_two: bool) -> Iterator[int]:
+    """
+    Reads rows one at a time, only ever holding three of them. Each row's total is yielded as soon as the
+    row below it has been read, as that's the last one that can affect it
+    """
+    above = EMPTY_ROW
+    current = None
+    for row_num, line in enumerate(lines):
+        below = make_window_row(line.rstrip("\n"), row_num)
+        if current is not None:
+            yield window_row_total(above, current, below, part_two)
+            above = current
+        current = below
+    if current is not None:
+        yield window_row_total(above, current, EMPTY_ROW, part_two)
+
+
+def stream_solution(lines: Iterable[str], part_two: bool) -> int:
+    return sum(stream_row_totals(lines, part_two))
+
+
+def test_stream_solution():
+    bundled = (Path(__file__).parent / "day3_input.txt").read_text()
+    for data in [EXAMPLE_DATA, bundled, "1*1", "..\n..", "12\n*.\n3.", "5"]:
+        for part_two in [False, True]:
+            lines = iter(line + "\n" for line in data.split("\n"))
+            assert stream_solution(lines, part_two) == solution(data, part_two)
+    # Past 2**63, so too big for any fixed-size integer column
+    long_numbers = ["11111111111111111111*", "....................3"]
+    assert solution("\n".join(long_numbers), False) == 11111111111111111114
+    assert solution("\n".join(long_numbers), True) == 33333333333333333333
+    assert stream_solution(iter(long_numbers), False) == 11111111111111111114
+    assert stream_solution(iter(long_numbers), True) == 33333333333333333333
+    assert list(stream_row_totals(EXAMPLE_DATA.split("\n"), False)) == [
+        467, 0, 35 + 633, 0, 617, 0, 592, 755, 0, 664 + 598
+    ]  # fmt: skip
+    assert stream_solution([], True) == 0
+
+
+def solve_band(
+    rows: list[str], halo_above: bool, halo_below: bool, part_two: bool
+) -> int:
+    totals = list(stream_row_totals(rows, part_two))
+    # Halo rows are only there as neighbors, their own totals belong to the band next door
+    return sum(totals[int(halo_above) : len(totals) - int(halo_below)])
+
+
+def parallel_solution(data: str, part_two: bool, workers: int) -> int:
+    """
+    Splits the grid into `workers` horizontal bands, each carrying a copy of the row above and below it,
+    and totals them in a process pool. Each band only counts the numbers and gears on its own rows, and the
+    halo rows give those everything they can touch, so gears on a band's edge are counted once and in full
+    """
+    rows = data.split("\n")
+    band_height = -(-len(rows) // workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                solve_band,
+                rows[max(start - 1, 0) : start + band_height + 1],
+                start > 0,
+                start + band_height < len(rows),
+                part_two,
+            )
+            for start in range(0, len(rows), band_height)
+        ]
+        return sum(future.result() for future in futures)
+
+
+def test_parallel_solution():
+    bundled = (Path(__file__).parent / "day3_input.txt").read_text()
+    for data in [EXAMPLE_DATA, bundled, "12\n*.\n3.", "5"]:
+        for part_two in [False, True]:
+            expected = solution(data, part_two)
+            for workers in [1, 2, 3, 7]:
+                assert parallel_solution(data, part_two, workers) == expected
+
+
 def main():
     parser = ArgumentParser()
     parser.add_argument(
@@ -323,24 +694,47 @@ def main():
         help="Run the program according to part 2 requirements",
     )
 
+    parser.add_argument(
+        "--engine",
+        default="python",
+        choices=["python", "numpy", "stream"],
+        help="Solve with the reference python code, vectorized over the whole grid with numpy, "
+        "or a few rows at a time as the input is read",
+    )
+
+    parser.add_argument(
+        "--workers",
+        default=None,
+        type=int,
+        help="Split the grid into this many bands and solve them in parallel processes. "
+        "Can't be combined with `--engine`",
+    )
+
     args = parser.parse_args()
+    if args.workers and args.engine != "python":
+        parser.error("--workers can't be combined with --engine numpy or stream")
 
-    data = """467..114..
-...*......
-..35..633.
-......#...
-617*......
-.....+.58.
-..592.....
-......755.
-...$.*....
-.664.598.."""
+    data = EXAMPLE_DATA
+
+    if args.engine == "stream":
+        if args.filename:
+            with open(args.filename) as f:
+                output = stream_solution(f, args.part_two)
+        else:
+            output = stream_solution(data.split("\n"), args.part_two)
+        print(f"Solution: {output}")
+        return
 
     if args.filename:
         with open(args.filename) as f:
             data = f.read()
 
-    output = solution(data, args.part_two)
+    if args.workers:
+        output = parallel_solution(data, args.part_two, args.workers)
+    elif args.engine == "numpy":
+        output = numpy_solution(data, args.part_two)
+    else:
+        output = solution(data, args.part_two)
 
     print(f"Solution: {output}")
 
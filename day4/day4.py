@@ -1,6 +1,13 @@
 from argparse import ArgumentParser
+from collections import deque
 from dataclasses import dataclass
+from itertools import accumulate
+from pathlib import Path
 import re
+from typing import Iterable, Iterator
+
+import numpy as np
+import pytest
 
 
 @dataclass
@@ -45,15 +52,19 @@ def test_parse_line():
     assert res.winning_nums == {41, 48, 83, 86, 17}
 
 
+def card_result(card_id: int, matching_nums: int) -> CardResult:
+    if matching_nums <= 1:
+        return CardResult(card_id, matching_nums, matching_nums)
+    return CardResult(card_id, matching_nums, 2 ** (matching_nums - 1))
+
+
 def score_card(line: str) -> CardResult:
     card = parse_line(line)
     matching_nums = 0
     for num in card.card_nums:
         if num in card.winning_nums:
             matching_nums += 1
-    if matching_nums <= 1:
-        return CardResult(card.card_id, matching_nums, matching_nums)
-    return CardResult(card.card_id, matching_nums, 2 ** (matching_nums - 1))
+    return card_result(card.card_id, matching_nums)
 
 
 def test_score_card():
@@ -65,23 +76,220 @@ def test_score_card():
     assert score_card("Card 6: 31 18 13 56 72 | 74 77 10 23 35 67 36 11") == CardResult(6, 0, 0)
 
 
-def solution(data: str, part_two: bool) -> int:
-    total = 0
-    lines = data.split("\n")
-    card_counts = [1] * (len(lines) + 1)
+def number_mask(numbers: list[str]) -> int:
+    mask = 0
+    for x in numbers:
+        mask |= 1 << int(x)
+    return mask
+
+
+def score_card_bits(line: str) -> CardResult:
+    """
+    Same as `score_card`, but with each side of the card as an `int` bitset of its numbers, so the
+    matches are just the bits set in both.
+    A drawn number that repeats sets fewer bits than there are drawn numbers. Every copy of it counts,
+    so then each drawn number is checked against the winning bits on its own
+    """
+    match = LINE_PATTERN.match(line)
+    if match is None:
+        print(f"Error, shouldn't happen, line: '{line}'")
+        return CardResult(-1, 0, 0)
+    card_num, remainder = match.group(1, 2)
+    winning, actual = remainder.split("|")
+    winning_mask = number_mask(winning.split())
+    drawn = actual.split()
+    drawn_mask = number_mask(drawn)
+    if drawn_mask.bit_count() == len(drawn):
+        matching_nums = (winning_mask & drawn_mask).bit_count()
+    else:
+        matching_nums = sum(winning_mask >> int(x) & 1 for x in drawn)
+    return card_result(int(card_num), matching_nums)
+
+
+def test_score_card_bits():
+    lines = [
+        "Card 1: 41 48 83 86 17 | 83 86  6 31 17  9 48 53",
+        "Card 2: 13 32 20 16 61 | 61 30 68 82 17 32 24 19",
+        "Card 3:  1 21 53 59 44 | 69 82 63 72 16 21 14  1",
+        "Card 4: 41 92 73 84 69 | 59 84 76 51 58  5 54 83",
+        "Card 5: 87 83 26 28 32 | 88 30 70 12 93 22 82 36",
+        "Card 6: 31 18 13 56 72 | 74 77 10 23 35 67 36 11",
+        "Card 7:  0 | 0 1",
+        "Card  8: 100 200 1000 | 1000 999 100",
+        # Repeated numbers, on either side
+        "Card 9:  3  3  5 |  3  7  3  5  5  5",
+        "Card 10: 1 2 | 4 4",
+    ]
     for line in lines:
-        res = score_card(line)
-        if part_two:
-            # Add to card_counts by the number of cards we had for this one for the next `matching_nums` cards
-            for i in range(res.card_num + 1, res.card_num + 1 + res.matching_nums):
-                card_counts[i] += card_counts[res.card_num]
-        else:
-            total += res.single_card_value
+        assert score_card_bits(line) == score_card(line)
+    # Every copy of a drawn number counts, like with `score_card`
+    assert score_card_bits(lines[-2]).matching_nums == 5
+
+
+SCORERS = {
+    "set": score_card,
+    "bitset": score_card_bits,
+}
+
+
+def card_counts(matches: Iterable[int]) -> Iterator[int]:
+    """
+    How many of each card are held by the end, in order, from each card's count of matching numbers.
+    A difference array of copies won: each card adds its count where its run of won cards starts and takes
+    it back off just after the run ends, so a running sum gives each card's copies in O(1) per card.
+    Only entries for cards still to come are kept, in a ring buffer no longer than the most matches any
+    card has had, and wins past the last card are dropped
+    """
+    copies_diff: deque[int] = deque()
+    copies = 0
+    for matching_nums in matches:
+        if copies_diff:
+            copies += copies_diff.popleft()
+        card_count = 1 + copies
+        yield card_count
+        if matching_nums > 0:
+            if len(copies_diff) <= matching_nums:
+                copies_diff.extend([0] * (matching_nums + 1 - len(copies_diff)))
+            copies_diff[0] += card_count
+            copies_diff[matching_nums] -= card_count
+
+
+def test_card_counts():
+    assert list(card_counts([4, 2, 2, 1, 0, 0])) == [1, 2, 4, 8, 14, 1]
+    assert list(card_counts([3, 3, 3, 3])) == [1, 2, 4, 8]
+    assert list(card_counts([])) == []
+
+
+def solution(data: str, part_two: bool, engine: str = "set") -> int:
+    score = SCORERS[engine]
+    results = [score(line) for line in data.split("\n")]
+    if part_two:
+        return sum(
+            card_counts(res.matching_nums for res in results if res.card_num >= 0)
+        )
+    return sum(res.single_card_value for res in results)
+
+
+def test_solution():
+    data = """Card 1: 41 48 83 86 17 | 83 86  6 31 17  9 48 53
+Card 2: 13 32 20 16 61 | 61 30 68 82 17 32 24 19
+Card 3:  1 21 53 59 44 | 69 82 63 72 16 21 14  1
+Card 4: 41 92 73 84 69 | 59 84 76 51 58  5 54 83
+Card 5: 87 83 26 28 32 | 88 30 70 12 93 22 82 36
+Card 6: 31 18 13 56 72 | 74 77 10 23 35 67 36 11"""
+    for engine in SCORERS:
+        assert solution(data, False, engine) == 13
+        assert solution(data, True, engine) == 30
+    # Every card winning the rest of the deck doubles the count each time, and wins past the end are dropped
+    data = "\n".join(f"Card {i}: 1 2 3 | 1 2 3" for i in range(1, 5))
+    assert solution(data, True) == 1 + 2 + 4 + 8
+
+
+def numpy_solution(data: str, part_two: bool) -> int:
+    """
+    Scores a whole deck at once, as long as every card has the same count of winning and drawn numbers.
+    Split on whitespace, every card is then the same count of tokens: `Card`, `N:`, the winning numbers, `|`,
+    and the drawn numbers. So the deck reshapes straight into one matrix for each side of the cards
+    """
+    first_winning, first_drawn = data.split("\n", 1)[0].split(":")[1].split("|")
+    winning_count = len(first_winning.split())
+    drawn_count = len(first_drawn.split())
+    tokens = np.array(data.split())
+    card_width = winning_count + drawn_count + 3
+    if len(tokens) % card_width != 0:
+        raise ValueError("Every card needs the same count of winning and drawn numbers")
+    tokens = tokens.reshape(-1, card_width)
+    winning = tokens[:, 2 : 2 + winning_count].astype(np.int64)
+    drawn = tokens[:, 3 + winning_count :].astype(np.int64)
+
+    # Shift each card's numbers into its own band of values, so sorting each card's winning numbers
+    # makes the whole matrix one sorted array, and every drawn number can be searched for at once
+    band = max(int(winning.max(initial=0)), int(drawn.max(initial=0))) + 1
+    card_offsets = np.arange(len(tokens), dtype=np.int64)[:, np.newaxis] * band
+    winning_keys = (np.sort(winning, axis=1) + card_offsets).ravel()
+    drawn_keys = drawn + card_offsets
+    found = np.searchsorted(winning_keys, drawn_keys)
+    matches = (
+        winning_keys[np.minimum(found, len(winning_keys) - 1)] == drawn_keys
+    ).sum(axis=1)
+
+    if not part_two:
+        won = matches[matches > 0]
+        # Every score is below 2 ** (most matches - 1), so the total fits in int64 while that times
+        # the count of winning cards does. Otherwise shift and add up python ints instead
+        if int(won.max(initial=0)) - 1 + len(won).bit_length() >= 63:
+            won = won.astype(object)
+        return int(np.left_shift(1, won - 1).sum())
+
+    # Each card's copies depend on the ones before it, so this part stays a loop, but O(1) per card
+    return sum(card_counts(matches.tolist()))
+
+
+def test_numpy_solution():
+    data = """Card 1: 41 48 83 86 17 | 83 86  6 31 17  9 48 53
+Card 2: 13 32 20 16 61 | 61 30 68 82 17 32 24 19
+Card 3:  1 21 53 59 44 | 69 82 63 72 16 21 14  1
+Card 4: 41 92 73 84 69 | 59 84 76 51 58  5 54 83
+Card 5: 87 83 26 28 32 | 88 30 70 12 93 22 82 36
+Card 6: 31 18 13 56 72 | 74 77 10 23 35 67 36 11"""
+    bundled = (Path(__file__).parent / "day4_input.txt").read_text()
+    for deck in [data, bundled]:
+        for part_two in [False, True]:
+            assert numpy_solution(deck, part_two) == solution(deck, part_two)
+
+    with pytest.raises(ValueError):
+        numpy_solution(data + "\nCard 7: 1 | 2", False)
+
+    # Scores past 2 ** 63 and numbers repeated on the same card
+    numbers = " ".join(str(x) for x in range(70))
+    deck = "\n".join(f"Card {i}: {numbers} | {numbers}" for i in range(1, 3))
+    deck += "\nCard 3: " + " ".join(["5"] * 70) + " | " + numbers
+    for part_two in [False, True]:
+        assert numpy_solution(deck, part_two) == solution(deck, part_two)
+    assert numpy_solution(deck, False) == 2 * 2**69 + 1
+
+
+def stream_card_totals(
+    lines: Iterable[str], part_two: bool, engine: str = "set"
+) -> Iterator[int]:
+    """
+    Reads cards one at a time, yielding the running total after each.
+    For part two, `card_counts` only holds on to copies won for cards not read yet
+    """
+    score = SCORERS[engine]
+    results = (score(line.rstrip("\n")) for line in lines)
     if part_two:
-        total = sum(card_counts[1:])
+        yield from accumulate(
+            card_counts(res.matching_nums for res in results if res.card_num >= 0)
+        )
+    else:
+        yield from accumulate(res.single_card_value for res in results)
+
+
+def stream_solution(lines: Iterable[str], part_two: bool, engine: str = "set") -> int:
+    total = 0
+    for total in stream_card_totals(lines, part_two, engine):
+        pass
     return total
 
 
+def test_stream_solution():
+    data = """Card 1: 41 48 83 86 17 | 83 86  6 31 17  9 48 53
+Card 2: 13 32 20 16 61 | 61 30 68 82 17 32 24 19
+Card 3:  1 21 53 59 44 | 69 82 63 72 16 21 14  1
+Card 4: 41 92 73 84 69 | 59 84 76 51 58  5 54 83
+Card 5: 87 83 26 28 32 | 88 30 70 12 93 22 82 36
+Card 6: 31 18 13 56 72 | 74 77 10 23 35 67 36 11"""
+    lines = [line + "\n" for line in data.split("\n")]
+    assert list(stream_card_totals(lines, False)) == [8, 10, 12, 13, 13, 13]
+    assert list(stream_card_totals(lines, True)) == [1, 3, 7, 15, 29, 30]
+    for engine in SCORERS:
+        assert stream_solution(iter(lines), True, engine) == 30
+    data = "\n".join(f"Card {i}: 1 2 3 | 1 2 3" for i in range(1, 5))
+    assert stream_solution(data.split("\n"), True) == solution(data, True)
+    assert stream_solution([], True) == 0
+
+
 def main():
     parser = ArgumentParser()
     parser.add_argument(
@@ -98,6 +306,13 @@ def main():
         help="Run the program according to part 2 requirements",
     )
 
+    parser.add_argument(
+        "--engine",
+        default="set",
+        choices=list(SCORERS) + ["numpy"],
+        help="How each card's matching numbers are counted, or `numpy` to score the whole deck at once",
+    )
+
     args = parser.parse_args()
 
     data = """Card 1: 41 48 83 86 17 | 83 86  6 31 17  9 48 53
@@ -107,11 +322,16 @@ Card 4: 41 92 73 84 69 | 59 84 76 51 58  5 54 83
 Card 5: 87 83 26 28 32 | 88 30 70 12 93 22 82 36
 Card 6: 31 18 13 56 72 | 74 77 10 23 35 67 36 11"""
 
-    if args.filename:
+    if args.engine == "numpy":
+        if args.filename:
+            with open(args.filename) as f:
+                data = f.read()
+        output = numpy_solution(data, args.part_two)
+    elif args.filename:
         with open(args.filename) as f:
-            data = f.read()
-
-    output = solution(data, args.part_two)
+            output = stream_solution(f, args.part_two, args.engine)
+    else:
+        output = solution(data, args.part_two, args.engine)
 
     print(f"Solution: {output}")
 
@@ -1,11 +1,60 @@
 from argparse import ArgumentParser
+from array import array
+from bisect import bisect_right
 from dataclasses import dataclass
+import hashlib
+import math
+import mmap
+import os
+from pathlib import Path
 import re
 
+import numpy as np
+import pytest
+
+# First two records of every cached almanac file: b"AOC5ALMN" read as an int64, then the layout version.
+# Bump the version whenever the layout changes, so files from older code get parsed again instead
+ALMANAC_MAGIC = int.from_bytes(b"AOC5ALMN", "little")
+ALMANAC_VERSION = 2
+
 # compile all patterns only once
 SEEDS_PATTERN = re.compile(r"^seeds: (.*)$")
 OTHER_MAPS_PATTERN = re.compile(r"^[a-z\-]+ map:\n(.*)$", re.DOTALL)
 
+EXAMPLE_DATA = """seeds: 79 14 55 13
+
+seed-to-soil map:
+50 98 2
+52 50 48
+
+soil-to-fertilizer map:
+0 15 37
+37 52 2
+39 0 15
+
+fertilizer-to-water map:
+49 53 8
+0 11 42
+42 0 7
+57 7 4
+
+water-to-light map:
+88 18 7
+18 25 70
+
+light-to-temperature map:
+45 77 23
+81 45 19
+68 64 13
+
+temperature-to-humidity map:
+0 69 1
+1 0 69
+
+humidity-to-location map:
+60 56 37
+56 93 4"""
+
 
 @dataclass
 class MappedRange:
@@ -52,23 +101,67 @@ def test_parse_mappings():
     ) == [MappedRange(1, 5, 2), MappedRange(81, 45, 19)]
 
 
-def apply_mapping(input_values: list[int], mappings: list[MappedRange]) -> list[int]:
-    output = []
-    for value in input_values:
-        new_value = value
-        for mapped_range in mappings:
-            if (
-                mapped_range.source_start
-                <= value
-                < mapped_range.source_start + mapped_range.range
-            ):
-                new_value = mapped_range.dest_start + (
-                    value - mapped_range.source_start
-                )
-                break
-        output.append(new_value)
+class MappingIndex:
+    """
+    One map's ranges sorted by `source_start` once, so a value can find the only range that could hold it
+    with a `bisect`. Assumes a map's source ranges never overlap, which the almanac guarantees
+    """
+
+    def __init__(self, mappings: list[MappedRange]):
+        self.ranges = sorted(mappings, key=lambda x: x.source_start)
+        self.starts = [x.source_start for x in self.ranges]
+
+    def lookup(self, value: int) -> int:
+        index = bisect_right(self.starts, value) - 1
+        if index >= 0:
+            mapped_range = self.ranges[index]
+            if value < mapped_range.source_start + mapped_range.range:
+                return mapped_range.dest_start + (value - mapped_range.source_start)
+        return value
+
+    def lookup_sorted(self, values: list[int]) -> list[int]:
+        """
+        Same as `lookup` on each value, but for values in ascending order, so one pointer can walk through
+        the ranges alongside them instead of searching from scratch each time
+        """
+        output = []
+        index = -1
+        for value in values:
+            while index + 1 < len(self.starts) and self.starts[index + 1] <= value:
+                index += 1
+            new_value = value
+            if index >= 0:
+                mapped_range = self.ranges[index]
+                if value < mapped_range.source_start + mapped_range.range:
+                    new_value = mapped_range.dest_start + (
+                        value - mapped_range.source_start
+                    )
+            output.append(new_value)
+        return output
 
-    return output
+
+def test_mapping_index():
+    index = MappingIndex(
+        [MappedRange(0, 15, 37), MappedRange(37, 52, 2), MappedRange(39, 0, 15)]
+    )
+    assert index.starts == [0, 15, 52]
+    assert index.lookup(0) == 39
+    assert index.lookup(14) == 53
+    assert index.lookup(15) == 0
+    assert index.lookup(53) == 38
+    assert index.lookup(54) == 54
+    values = [0, 13, 14, 15, 51, 52, 53, 54, 100]
+    assert index.lookup_sorted(values) == [index.lookup(x) for x in values]
+    assert MappingIndex([]).lookup_sorted([1, 2]) == [1, 2]
+
+
+def apply_mapping(input_values: list[int], mappings: list[MappedRange]) -> list[int]:
+    index = MappingIndex(mappings)
+    # Already sorted values can walk through the ranges once. Sorting them first would cost more than
+    # a bisect each, since there are usually far more values than ranges
+    if all(a <= b for a, b in zip(input_values, input_values[1:])):
+        return index.lookup_sorted(input_values)
+    return [index.lookup(value) for value in input_values]
 
 
 def test_apply_mapping():
@@ -83,9 +176,417 @@ def test_apply_mapping():
         [81, 14, 57, 13],
         [MappedRange(0, 15, 37), MappedRange(37, 52, 2), MappedRange(39, 0, 15)],
     ) == [81, 53, 57, 52]
+    # Sorted values take the single walk
+    assert apply_mapping([13, 55, 79], [MappedRange(52, 50, 48)]) == [13, 57, 81]
+
+
+def parse_almanac(
+    data: str, cache_dir: Path | None = None
+) -> tuple[list[int], list[list[MappedRange]]]:
+    """
+    Seeds, and each map's ranges sorted by `source_start`.
+    With a `cache_dir`, a previous parse of the same text is loaded from there instead, or saved there
+    for next time
+    """
+    if cache_dir is not None:
+        cache_path = almanac_cache_path(data, cache_dir)
+        if cache_path.exists():
+            try:
+                return load_almanac(cache_path)
+            except ValueError:
+                # Damaged or from an older version, parse again below and replace it
+                pass
+
+    data_split = data.split("\n\n")
+    stages = [
+        sorted(parse_mapping(x), key=lambda x: x.source_start) for x in data_split[1:]
+    ]
+    seeds = get_starting_values(data_split[0])
+
+    if cache_dir is not None:
+        save_almanac(cache_path, seeds, stages)
+    return seeds, stages
+
+
+def almanac_cache_path(data: str, cache_dir: Path) -> Path:
+    return cache_dir / f"{hashlib.sha256(data.encode()).hexdigest()}.almanac"
+
+
+def save_almanac(path: Path, seeds: list[int], stages: list[list[MappedRange]]):
+    """
+    Written as nothing but int64 records: a header of `ALMANAC_MAGIC`, `ALMANAC_VERSION`, the seed count,
+    the map count and the range count of each map, then the seeds, then each range as
+    `dest_start, source_start, range`
+    """
+    records = array("q", [ALMANAC_MAGIC, ALMANAC_VERSION, len(seeds), len(stages)])
+    records.extend(len(mappings) for mappings in stages)
+    records.extend(seeds)
+    for mappings in stages:
+        for x in mappings:
+            records.extend((x.dest_start, x.source_start, x.range))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Written to the side first, so a half-written file can never be picked up by another run
+    temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(temp_path, "wb") as f:
+        records.tofile(f)
+    os.replace(temp_path, path)
+
+
+def load_almanac(path: Path) -> tuple[list[int], list[list[MappedRange]]]:
+    """
+    Raises `ValueError` for anything that isn't a complete cache file written by this version
+    """
+    with open(path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as buffer:
+        if len(buffer) % 8 != 0:
+            raise ValueError(f"{path} is not a whole number of records")
+        with memoryview(buffer).cast("q") as records:
+            if (
+                len(records) < 4
+                or records[0] != ALMANAC_MAGIC
+                or records[1] != ALMANAC_VERSION
+            ):
+                raise ValueError(f"{path} is not a cached almanac from this version")
+            seed_count, stage_count = records[2], records[3]
+            position = 4 + stage_count
+            if seed_count < 0 or stage_count < 0 or len(records) < position:
+                raise ValueError(f"{path} has a damaged header")
+            stage_counts = records[4:position].tolist()
+            expected_length = position + seed_count + 3 * sum(stage_counts)
+            if min(stage_counts, default=0) < 0 or len(records) != expected_length:
+                raise ValueError(f"{path} doesn't match the counts in its header")
+            seeds = records[position : position + seed_count].tolist()
+            position += seed_count
+            stages = []
+            for count in stage_counts:
+                fields = records[position : position + count * 3].tolist()
+                stages.append(
+                    [MappedRange(*fields[i : i + 3]) for i in range(0, len(fields), 3)]
+                )
+                position += count * 3
+    return seeds, stages
+
+
+def test_almanac_cache(tmp_path):
+    seeds, stages = parse_almanac(EXAMPLE_DATA)
+    assert parse_almanac(EXAMPLE_DATA, tmp_path) == (seeds, stages)
+    cache_path = almanac_cache_path(EXAMPLE_DATA, tmp_path)
+    assert cache_path.exists()
+    assert load_almanac(cache_path) == (seeds, stages)
+    assert stages[0] == [MappedRange(52, 50, 48), MappedRange(50, 98, 2)]
+
+    # Loaded from the cache, not the text, on the next run
+    save_almanac(cache_path, [1], [])
+    assert parse_almanac(EXAMPLE_DATA, tmp_path) == ([1], [])
+    assert compiled_solution(EXAMPLE_DATA, tmp_path) == 1
+
+    # Anything short, damaged or from another version is rejected, then parsed again and rewritten
+    save_almanac(cache_path, seeds, stages)
+    complete = cache_path.read_bytes()
+    old_version = array("q", [ALMANAC_MAGIC, ALMANAC_VERSION - 1]).tobytes()
+    for damaged in [
+        complete[:-48],
+        complete[:-20],
+        complete + bytes(24),
+        old_version + complete[16:],
+        bytes(8),
+        b"",
+    ]:
+        cache_path.write_bytes(damaged)
+        with pytest.raises(ValueError):
+            load_almanac(cache_path)
+        assert parse_almanac(EXAMPLE_DATA, tmp_path) == (seeds, stages)
+        assert cache_path.read_bytes() == complete
+
+
+class CompiledAlmanac:
+    """
+    A chain of maps composed into a single piecewise-linear map, sorted by `starts`.
+    Segment `i` covers `[starts[i], starts[i + 1])` (the last one runs forever) and adds `offsets[i]` to
+    anything in it, with gaps in the original maps included as 0 offsets, so every value from 0 upwards is
+    covered by exactly one segment
+    """
+
+    def __init__(self, starts: list[int], offsets: list[int]):
+        self.starts = starts
+        self.offsets = offsets
+
+    @classmethod
+    def from_mappings(cls, mappings: list[MappedRange]) -> "CompiledAlmanac":
+        starts = []
+        offsets = []
+        position = 0
+        for mapped_range in sorted(mappings, key=lambda x: x.source_start):
+            if mapped_range.source_start > position:
+                starts.append(position)
+                offsets.append(0)
+            starts.append(mapped_range.source_start)
+            offsets.append(mapped_range.dest_start - mapped_range.source_start)
+            position = mapped_range.source_start + mapped_range.range
+        starts.append(position)
+        offsets.append(0)
+        return cls.merged(starts, offsets)
+
+    @classmethod
+    def merged(cls, starts: list[int], offsets: list[int]) -> "CompiledAlmanac":
+        # Neighboring segments with the same offset are really one segment, and empty ones can go entirely
+        merged_starts = []
+        merged_offsets = []
+        for i, (start, offset) in enumerate(zip(starts, offsets)):
+            if i + 1 < len(starts) and starts[i + 1] == start:
+                continue
+            if merged_offsets and merged_offsets[-1] == offset:
+                continue
+            merged_starts.append(start)
+            merged_offsets.append(offset)
+        return cls(merged_starts, merged_offsets)
+
+    @classmethod
+    def compile(cls, stages: list[list[MappedRange]]) -> "CompiledAlmanac":
+        compiled = cls([0], [0])
+        for mappings in stages:
+            compiled = compiled.then(cls.from_mappings(mappings))
+        return compiled
+
+    def segment_end(self, index: int) -> int | float:
+        return self.starts[index + 1] if index + 1 < len(self.starts) else math.inf
+
+    def then(self, other: "CompiledAlmanac") -> "CompiledAlmanac":
+        """
+        This map followed by `other`. Each of our segments lands somewhere in `other`, and gets split
+        wherever one of `other`'s segments starts inside where it lands
+        """
+        starts = []
+        offsets = []
+        for i, (start, offset) in enumerate(zip(self.starts, self.offsets)):
+            landed_start = start + offset
+            landed_end = self.segment_end(i) + offset
+            j = bisect_right(other.starts, landed_start) - 1
+            starts.append(start)
+            offsets.append(offset + other.offsets[j])
+            j += 1
+            while j < len(other.starts) and other.starts[j] < landed_end:
+                starts.append(other.starts[j] - offset)
+                offsets.append(offset + other.offsets[j])
+                j += 1
+        return self.merged(starts, offsets)
+
+    def segments(self) -> list[tuple[int, int | float, int]]:
+        return [
+            (start, self.segment_end(i) - start, offset)
+            for i, (start, offset) in enumerate(zip(self.starts, self.offsets))
+        ]
+
+    def lookup(self, value: int) -> int:
+        return value + self.offsets[bisect_right(self.starts, value) - 1]
+
+    def lookup_range(self, start: int, length: int) -> list[tuple[int, int]]:
+        """
+        Every `(start, length)` piece `[start, start + length)` is mapped to, one per segment it crosses
+        """
+        output = []
+        end = start + length
+        i = bisect_right(self.starts, start) - 1
+        while start < end:
+            piece_end = min(end, self.segment_end(i))
+            output.append((start + self.offsets[i], piece_end - start))
+            start = piece_end
+            i += 1
+        return output
+
+
+def test_compiled_almanac():
+    seeds, stages = parse_almanac(EXAMPLE_DATA)
+    compiled = CompiledAlmanac.compile(stages)
+    for seed in list(range(120)) + [10**12]:
+        value = seed
+        for mappings in stages:
+            value = apply_mapping([value], mappings)[0]
+        assert compiled.lookup(seed) == value
+
+    # seed 79 maps through to location 82, and its neighbors follow it until a segment boundary
+    assert compiled.lookup_range(79, 1) == [(82, 1)]
+    assert sum(length for _, length in compiled.lookup_range(79, 14)) == 14
+    assert min(x for x, _ in compiled.lookup_range(79, 14)) == 46
+    assert compiled.segments()[0][0] == 0
+    assert compiled.segments()[-1][1] == math.inf
+
+    single = CompiledAlmanac.from_mappings(
+        [MappedRange(50, 98, 2), MappedRange(52, 50, 48)]
+    )
+    assert single.starts == [0, 50, 98, 100]
+    assert single.offsets == [0, 2, -48, 0]
+
+
+class ReverseAlmanac:
+    """
+    A `CompiledAlmanac` turned around: each segment listed by the locations it lands on, lowest first,
+    along with where it came from. Finding the lowest location then means walking up from location 0 and
+    only looking at which seeds reach each segment, which can stop as soon as no segment left can beat the
+    best location found so far
+    """
+
+    def __init__(self, compiled: CompiledAlmanac):
+        # (location start, location end, seed start) for each segment
+        self.segments = sorted(
+            (
+                start + offset,
+                compiled.segment_end(i) + offset,
+                start,
+            )
+            for i, (start, offset) in enumerate(zip(compiled.starts, compiled.offsets))
+        )
+
+    def min_location(self, seed_ranges: list[tuple[int, int]]) -> int | float:
+        """
+        Lowest location reachable from any `(start, length)` seed range, or `inf` with no seeds
+        """
+        seeds = []
+        for start, length in sorted(seed_ranges):
+            if length <= 0:
+                continue
+            if seeds and start <= seeds[-1][1]:
+                seeds[-1][1] = max(seeds[-1][1], start + length)
+            else:
+                seeds.append([start, start + length])
+        seed_ends = [end for _, end in seeds]
+
+        best = math.inf
+        for location_start, location_end, seed_start in self.segments:
+            if location_start >= best:
+                # Segments are in location order, nothing further on can do better
+                break
+            seed_end = seed_start + (location_end - location_start)
+            # First seed range that hasn't finished before this segment starts
+            i = bisect_right(seed_ends, seed_start)
+            if i < len(seeds) and seeds[i][0] < seed_end:
+                first_seed = max(seeds[i][0], seed_start)
+                best = min(best, first_seed + location_start - seed_start)
+        return best
+
+
+def test_reverse_almanac():
+    seeds, stages = parse_almanac(EXAMPLE_DATA)
+    reverse = ReverseAlmanac(CompiledAlmanac.compile(stages))
+    assert reverse.min_location([(seed, 1) for seed in seeds]) == 35
+    assert reverse.min_location([(79, 14), (55, 13)]) == 46
+    assert reverse.min_location([(82, 1)]) == 46
+    assert reverse.min_location([(14, 1)]) == 43
+    assert reverse.min_location([]) == math.inf
+    locations = [e[0] for e in reverse.segments]
+    assert locations == sorted(locations)
+
+
+class Almanac:
+    """
+    Everything both parts need from one parse of the input. Point seeds are just seed ranges of length 1,
+    so both parts go through the same reverse search over the compiled maps
+    """
+
+    def __init__(self, seeds: list[int], stages: list[list[MappedRange]]):
+        self.seeds = seeds
+        self.compiled = CompiledAlmanac.compile(stages)
+        self.reverse = ReverseAlmanac(self.compiled)
+
+    @classmethod
+    def from_data(cls, data: str, cache_dir: Path | None = None) -> "Almanac":
+        return cls(*parse_almanac(data, cache_dir))
+
+    def seed_ranges(self, part_two: bool) -> list[tuple[int, int]]:
+        if part_two:
+            # Seeds come in pairs of start and length
+            if len(self.seeds) % 2:
+                raise ValueError(
+                    f"Expected seeds in pairs of start and length, got {len(self.seeds)} numbers"
+                )
+            return list(zip(self.seeds[::2], self.seeds[1::2]))
+        return [(seed, 1) for seed in self.seeds]
+
+    def min_location(self, part_two: bool) -> int:
+        location = self.reverse.min_location(self.seed_ranges(part_two))
+        if location == math.inf:
+            raise ValueError("No seeds to find a location for")
+        return location
+
+
+def test_almanac():
+    almanac = Almanac.from_data(EXAMPLE_DATA)
+    assert almanac.seed_ranges(False) == [(79, 1), (14, 1), (55, 1), (13, 1)]
+    assert almanac.seed_ranges(True) == [(79, 14), (55, 13)]
+    assert almanac.min_location(False) == 35
+    assert almanac.min_location(True) == 46
+
+    bundled = (Path(__file__).parent / "day5_input.txt").read_text()
+    almanac = Almanac.from_data(bundled)
+    assert almanac.min_location(False) == solution(bundled, False)
+    assert almanac.min_location(True) == min(
+        location
+        for start, length in almanac.seed_ranges(True)
+        for location, _ in almanac.compiled.lookup_range(start, length)
+    )
+
+
+def test_almanac_bad_seeds():
+    stages = parse_almanac(EXAMPLE_DATA)[1]
+    with pytest.raises(ValueError):
+        Almanac([79, 14, 55], stages).min_location(True)
+    with pytest.raises(ValueError):
+        Almanac([], stages).min_location(False)
+
+
+def compiled_solution(data: str, cache_dir: Path | None = None) -> int:
+    seeds, stages = parse_almanac(data, cache_dir)
+    compiled = CompiledAlmanac.compile(stages)
+    return min(compiled.lookup(seed) for seed in seeds)
+
+
+def numpy_apply_mapping(values: np.ndarray, mappings: list[MappedRange]) -> np.ndarray:
+    """
+    `apply_mapping` for a whole array of values at once, updated in place rather than building a new list.
+    Each value finds the last range starting at or before it with `searchsorted`, and only values that
+    actually land inside that range get its offset added
+    """
+    if not mappings:
+        return values
+    ranges = sorted(mappings, key=lambda x: x.source_start)
+    starts = np.array([x.source_start for x in ranges], dtype=np.int64)
+    ends = starts + np.array([x.range for x in ranges], dtype=np.int64)
+    offsets = np.array([x.dest_start - x.source_start for x in ranges], dtype=np.int64)
+
+    index = np.searchsorted(starts, values, side="right") - 1
+    inside = index >= 0
+    inside[inside] = values[inside] < ends[index[inside]]
+    values[inside] += offsets[index[inside]]
+    return values
+
+
+def test_numpy_apply_mapping():
+    values = np.array([79, 14, 55, 13, 98, 99, 100, 0], dtype=np.int64)
+    mappings = [MappedRange(50, 98, 2), MappedRange(52, 50, 48)]
+    expected = apply_mapping(values.tolist(), mappings)
+    assert numpy_apply_mapping(values, mappings).tolist() == expected
+    assert numpy_apply_mapping(np.array([5]), []).tolist() == [5]
+
+
+def numpy_solution(data: str, cache_dir: Path | None = None) -> int:
+    seeds, stages = parse_almanac(data, cache_dir)
+    values = np.array(seeds, dtype=np.int64)
+    for mappings in stages:
+        values = numpy_apply_mapping(values, mappings)
+    return int(values.min())
+
+
+def test_numpy_solution():
+    bundled = (Path(__file__).parent / "day5_input.txt").read_text()
+    for data in [EXAMPLE_DATA, bundled]:
+        assert numpy_solution(data) == solution(data, False)
 
 
 def solution(data: str, part_two: bool) -> int:
+    if part_two:
+        # Seed ranges are far too big to step through one value at a time
+        return Almanac.from_data(data).min_location(True)
     data_split = data.split("\n\n")
     values = get_starting_values(data_split[0])
     for i in range(1, len(data_split)):
@@ -108,55 +609,55 @@ def main():
         "--part-two",
         default=False,
         action="store_true",
-        help="To produce output for the part2 version of this problem",
+        help="To produce output for the part2 version of this problem. Always uses the `almanac` engine",
     )
 
-    args = parser.parse_args()
-
-    data = """seeds: 79 14 55 13
-
-seed-to-soil map:
-50 98 2
-52 50 48
-
-soil-to-fertilizer map:
-0 15 37
-37 52 2
-39 0 15
-
-fertilizer-to-water map:
-49 53 8
-0 11 42
-42 0 7
-57 7 4
+    parser.add_argument(
+        "--both",
+        default=False,
+        action="store_true",
+        help="Produce output for both parts from a single parse of the input",
+    )
 
-water-to-light map:
-88 18 7
-18 25 70
+    parser.add_argument(
+        "--engine",
+        default="python",
+        choices=["python", "compiled", "numpy", "almanac"],
+        help="Apply each map in turn, compose them all into one map first, "
+        "apply each map to every seed at once with numpy, "
+        "or search backwards from the lowest locations with the `Almanac` engine shared by both parts",
+    )
 
-light-to-temperature map:
-45 77 23
-81 45 19
-68 64 13
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        type=Path,
+        help="Keep parsed almanacs in this directory, so running the same input again skips parsing. "
+        "Not used by the `python` engine",
+    )
 
-temperature-to-humidity map:
-0 69 1
-1 0 69
+    args = parser.parse_args()
 
-humidity-to-location map:
-60 56 37
-56 93 4"""
+    data = EXAMPLE_DATA
 
     if args.filename:
         with open(args.filename) as f:
             data = f.read()
 
-    if args.part_two:
-        print(
-            "Part 2 for this problem is found in day5_part2.py, sorry for the inconvenience!"
-        )
+    if args.both:
+        almanac = Almanac.from_data(data, args.cache_dir)
+        print(f"Part 1 solution: {almanac.min_location(False)}")
+        print(f"Part 2 solution: {almanac.min_location(True)}")
         return
-    output = solution(data, args.part_two)
+
+    if args.part_two or args.engine == "almanac":
+        output = Almanac.from_data(data, args.cache_dir).min_location(args.part_two)
+    elif args.engine == "compiled":
+        output = compiled_solution(data, args.cache_dir)
+    elif args.engine == "numpy":
+        output = numpy_solution(data, args.cache_dir)
+    else:
+        output = solution(data, args.part_two)
 
     print(f"Solution: {output}")
 
@@ -1,12 +1,13 @@
-# Moved part 2 out into a different file since the approach completely changed
+# Moved part 2 out into a different file since the approach completely changed.
+# `day5.py --part-two` now answers it too, through the `Almanac` engine shared by both parts
 from argparse import ArgumentParser
+from array import array
 from dataclasses import dataclass
 from collections import deque
-import re
+from pathlib import Path
 
-# compile all patterns only once
-SEEDS_PATTERN = re.compile(r"^seeds: (.*)$")
-OTHER_MAPS_PATTERN = re.compile(r"^[a-z\-]+ map:\n(.*)$", re.DOTALL)
+# Parsing and the almanac engine shared by both parts live alongside part 1
+import day5
 
 
 # This approach needs to speak in Ranges, as calculating by individual numbers is prohibitively expensive memory-wise
@@ -163,11 +164,7 @@ def test_apply_transform():
 
 
 def get_starting_ranges(line: str) -> list[Range]:
-    match = SEEDS_PATTERN.match(line)
-    if match is None:
-        print("Error: regex didn't match for seeds")
-        return []
-    values = [int(x) for x in match.group(1).split(" ")]
+    values = day5.get_starting_values(line)
     output = []
     for i in range(0, len(values), 2):
         output.append(Range(values[i], values[i + 1]))
@@ -184,20 +181,11 @@ def test_get_starting_ranges():
 
 
 def parse_mapping(data: str) -> list[MappedRange]:
-    output = []
-    match = OTHER_MAPS_PATTERN.match(data)
-    if match is None:
-        print("Error: regex didn't match for map")
-        return output
-    for line in match.group(1).split("\n"):
-        dest_start, source_start, duration = line.split(" ")
-        output.append(
-            MappedRange(
-                Range(int(source_start), int(duration)),
-                int(dest_start) - int(source_start),
-            )
-        )
-    return output
+    # Same parse as part 1, just reshaped into an input range and an offset
+    return [
+        MappedRange(Range(x.source_start, x.range), x.dest_start - x.source_start)
+        for x in day5.parse_mapping(data)
+    ]
 
 
 def test_parse_mappings():
@@ -212,27 +200,62 @@ def test_parse_mappings():
     ) == [MappedRange(Range(5, 2), -4), MappedRange(Range(45, 19), 36)]
 
 
+def merge_ranges(ranges: list[Range]) -> list[Range]:
+    # Sorted, with any overlapping or touching ranges joined into one
+    merged: list[Range] = []
+    for r in sorted(ranges):
+        if merged and r.start <= merged[-1].end:
+            if r.end > merged[-1].end:
+                merged[-1] = Range(merged[-1].start, r.end - merged[-1].start)
+        else:
+            merged.append(r)
+    return merged
+
+
+def test_merge_ranges():
+    assert merge_ranges([]) == []
+    assert merge_ranges([Range(5, 2), Range(0, 5)]) == [Range(0, 7)]
+    assert merge_ranges([Range(0, 10), Range(2, 3)]) == [Range(0, 10)]
+    assert merge_ranges([Range(0, 3), Range(2, 3), Range(9, 1)]) == [
+        Range(0, 5),
+        Range(9, 1),
+    ]
+
+
 def apply_mapping(
     current_ranges: list[Range], mappings: list[MappedRange]
 ) -> list[Range]:
-    # For each mapping group, process all of `current_ranges` once. If a range has been transformed, put it into `next_ranges`
+    """
+    Sweeps through the ranges and the mappings together, both sorted by start, cutting each range wherever
+    a mapping starts or ends inside it. Output is merged with `merge_ranges`, so fragments don't pile up
+    from one map to the next
+    """
+    mappings = sorted(mappings, key=lambda x: x.input_range.start)
     next_ranges: list[Range] = []
-    unmapped_ranges: list[Range] = []
-    for mapping in mappings:
-        for range_to_check in current_ranges:
-            res: TransformResult = apply_transform(range_to_check, mapping)
-            if res.transformed():
-                unmapped_ranges.extend(res.remainders)
-                next_ranges.append(res.transformed_range)
+    # First mapping that could still overlap the current range, as range starts only go up
+    first_mapping = 0
+    for range_to_map in merge_ranges(current_ranges):
+        while (
+            first_mapping < len(mappings)
+            and mappings[first_mapping].input_range.end <= range_to_map.start
+        ):
+            first_mapping += 1
+        start = range_to_map.start
+        i = first_mapping
+        while start < range_to_map.end:
+            if i < len(mappings) and mappings[i].input_range.start <= start:
+                # Inside this mapping, transform up to wherever the range or the mapping ends
+                end = min(range_to_map.end, mappings[i].input_range.end)
+                next_ranges.append(Range(start + mappings[i].offset, end - start))
+                i += 1
             else:
-                unmapped_ranges.append(res.unchanged)
-        current_ranges = unmapped_ranges
-        unmapped_ranges = []
-
-    # If we still have values in `current_ranges`, they weren't applied to any mapping.
-    # Put into next_ranges as-is
-    next_ranges.extend(current_ranges)
-    return next_ranges
+                # Not covered by a mapping up to the next one starting, so it passes through as-is
+                end = range_to_map.end
+                if i < len(mappings):
+                    end = min(end, mappings[i].input_range.start)
+                next_ranges.append(Range(start, end - start))
+            start = end
+    return merge_ranges(next_ranges)
 
 
 def test_apply_mapping():
@@ -241,7 +264,7 @@ def test_apply_mapping():
 
     new_ranges = apply_mapping(current_ranges, mappings)
     assert len(new_ranges) == 2
-    assert new_ranges == [Range(81, 14), Range(57, 13)]
+    assert new_ranges == [Range(57, 13), Range(81, 14)]
 
     current_ranges = new_ranges
     mappings = [
@@ -251,7 +274,7 @@ def test_apply_mapping():
     ]
     new_ranges = apply_mapping(current_ranges, mappings)
     assert len(new_ranges) == 2
-    assert new_ranges == [Range(81, 14), Range(57, 13)]
+    assert new_ranges == [Range(57, 13), Range(81, 14)]
 
     current_ranges = new_ranges
     mappings = [
@@ -262,18 +285,150 @@ def test_apply_mapping():
     ]
     new_ranges = apply_mapping(current_ranges, mappings)
     assert len(new_ranges) == 3
-    assert new_ranges == [Range(53, 4), Range(81, 14), Range(61, 9)]
+    assert new_ranges == [Range(53, 4), Range(61, 9), Range(81, 14)]
+
+    # Pieces landing next to each other get merged back together
+    new_ranges = apply_mapping(
+        [Range(0, 10)], [MappedRange(Range(0, 5), 5), MappedRange(Range(5, 5), -5)]
+    )
+    assert new_ranges == [Range(0, 10)]
+    # A range spanning several mappings and the gaps between them
+    new_ranges = apply_mapping(
+        [Range(0, 20)], [MappedRange(Range(2, 3), 100), MappedRange(Range(10, 2), 200)]
+    )
+    assert new_ranges == [
+        Range(0, 2),
+        Range(5, 5),
+        Range(12, 8),
+        Range(102, 3),
+        Range(210, 2),
+    ]
+
+
+class RangeBuffer:
+    """
+    The same ranges as a list of `Range`s, but held as two parallel `array('q')` columns of starts and
+    (exclusive) ends, so splitting a range is two appends rather than new objects
+    """
+
+    __slots__ = ("starts", "ends")
+
+    def __init__(self):
+        self.starts = array("q")
+        self.ends = array("q")
+
+    @classmethod
+    def from_ranges(cls, ranges: list[Range]) -> "RangeBuffer":
+        buffer = cls()
+        for r in ranges:
+            buffer.starts.append(r.start)
+            buffer.ends.append(r.end)
+        return buffer
+
+    def to_ranges(self) -> list[Range]:
+        return [Range(start, end - start) for start, end in zip(self.starts, self.ends)]
+
+    def clear(self):
+        del self.starts[:]
+        del self.ends[:]
+
+    def merge_into(self, output: "RangeBuffer"):
+        """
+        Same as `merge_ranges`, written into `output` after clearing it
+        """
+        output.clear()
+        starts = self.starts
+        ends = self.ends
+        for i in sorted(range(len(starts)), key=starts.__getitem__):
+            if output.ends and starts[i] <= output.ends[-1]:
+                if ends[i] > output.ends[-1]:
+                    output.ends[-1] = ends[i]
+            else:
+                output.starts.append(starts[i])
+                output.ends.append(ends[i])
+
+
+def map_range_buffer(
+    current: RangeBuffer, mappings: list[MappedRange], output: RangeBuffer
+):
+    """
+    The same sweep as `apply_mapping`, over a sorted and merged `current`, writing the unmerged pieces
+    into `output` after clearing it
+    """
+    mappings = sorted(mappings, key=lambda x: x.input_range.start)
+    map_starts = array("q", [x.input_range.start for x in mappings])
+    map_ends = array("q", [x.input_range.end for x in mappings])
+    map_offsets = array("q", [x.offset for x in mappings])
+    map_count = len(mappings)
+
+    output.clear()
+    first_mapping = 0
+    for start, range_end in zip(current.starts, current.ends):
+        while first_mapping < map_count and map_ends[first_mapping] <= start:
+            first_mapping += 1
+        i = first_mapping
+        while start < range_end:
+            if i < map_count and map_starts[i] <= start:
+                end = min(range_end, map_ends[i])
+                output.starts.append(start + map_offsets[i])
+                output.ends.append(end + map_offsets[i])
+                i += 1
+            else:
+                end = range_end if i == map_count else min(range_end, map_starts[i])
+                output.starts.append(start)
+                output.ends.append(end)
+            start = end
+
+
+def test_map_range_buffer():
+    cases = [
+        (
+            [Range(79, 14), Range(55, 13)],
+            [MappedRange(Range(98, 2), -48), MappedRange(Range(50, 48), 2)],
+        ),
+        (
+            [Range(57, 13), Range(81, 14)],
+            [
+                MappedRange(Range(53, 8), -4),
+                MappedRange(Range(11, 42), -11),
+                MappedRange(Range(0, 7), 42),
+                MappedRange(Range(7, 4), 50),
+            ],
+        ),
+        (
+            [Range(0, 20), Range(15, 10)],
+            [MappedRange(Range(2, 3), 100), MappedRange(Range(10, 2), 200)],
+        ),
+        ([Range(0, 10)], [MappedRange(Range(0, 5), 5), MappedRange(Range(5, 5), -5)]),
+    ]
+    current = RangeBuffer()
+    pieces = RangeBuffer()
+    for ranges, mappings in cases:
+        RangeBuffer.from_ranges(ranges).merge_into(current)
+        map_range_buffer(current, mappings, pieces)
+        pieces.merge_into(current)
+        assert current.to_ranges() == apply_mapping(ranges, mappings)
 
 
 def solution(data: str) -> int:
     data_split = data.split("\n\n")
-    current_ranges = get_starting_ranges(data_split[0])
+    # Two buffers swapped back and forth: one gets mapped into the other, then merged back
+    current = RangeBuffer()
+    pieces = RangeBuffer.from_ranges(get_starting_ranges(data_split[0]))
+    pieces.merge_into(current)
     for i in range(1, len(data_split)):
-        current_ranges = apply_mapping(current_ranges, parse_mapping(data_split[i]))
-        # TODO: maybe need to merge overlapping intervals at this point to reduce future iteration complexities?
+        map_range_buffer(current, parse_mapping(data_split[i]), pieces)
+        pieces.merge_into(current)
+
+    # Now, just get the smallest range's starting value to get the lowest number possible after all mappings were completed.
+    # Merged ranges are kept sorted, so that's the first one
+    return current.starts[0]
 
-    # Now, just get the smallest range's starting value to get the lowest number possible after all mappings were completed
-    return min(current_ranges).start
+
+def test_almanac_solution():
+    bundled = (Path(__file__).parent / "day5_input.txt").read_text()
+    for data in [day5.EXAMPLE_DATA, bundled]:
+        assert day5.Almanac.from_data(data).min_location(True) == solution(data)
 
 
 def main():
@@ -285,6 +440,22 @@ def main():
         help="Filename containing input data. If not provided, uses the example from the problem",
     )
 
+    parser.add_argument(
+        "--engine",
+        default="ranges",
+        choices=["ranges", "almanac"],
+        help="Push the seed ranges through each map in turn, "
+        "or search backwards from the lowest locations with the `Almanac` engine shared with part one",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        type=Path,
+        help="Keep parsed almanacs in this directory, so running the same input again skips parsing. "
+        "Not used by the `ranges` engine",
+    )
+
     args = parser.parse_args()
 
     data = """seeds: 79 14 55 13
@@ -325,7 +496,10 @@ humidity-to-location map:
         with open(args.filename) as f:
             data = f.read()
 
-    output = solution(data)
+    if args.engine == "almanac":
+        output = day5.Almanac.from_data(data, args.cache_dir).min_location(True)
+    else:
+        output = solution(data)
 
     print(f"Solution: {output}")
 